@@ -8,17 +8,19 @@
 
 import os
 import fitz  # PyMuPDF
+import hashlib
 import json
 import re
-from pdf2image import convert_from_path
+import ahocorasick
 from PIL import Image
-import pytesseract
+import tesserocr
 import logging
 from tkinter import Tk, Button, Label, IntVar
 from tkinter.filedialog import askopenfilenames, askdirectory
 from tkinter import ttk
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Configure logging
 logging.basicConfig(
@@ -27,67 +29,140 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+TEMPLATE_JSON_PATH = "C:\\Users\\Brian Mahan\\OneDrive - waynecompany.com\\Desktop\\Python scripts\\Sorting program\\Template.json"
 
-# Load template JSON
-def load_templates(json_path="C:\\Users\\Brian Mahan\\OneDrive - waynecompany.com\\Desktop\\Python scripts\\Sorting program\\Template.json"):
+# Load template JSON and pre-compile each company's patterns once
+def load_templates(json_path=TEMPLATE_JSON_PATH):
     try:
         with open(json_path, "r") as file:
-            return json.load(file)
+            templates = json.load(file)
     except FileNotFoundError:
         logging.error("Template JSON file not found.")
         return {}
+    except json.JSONDecodeError as e:
+        logging.error(f"Template JSON is malformed: {e}")
+        return {}
+
+    # Bad template definitions are logged rather than crashing the app, since
+    # this also runs at import and from the Reload Templates button
+    try:
+        # One Aho-Corasick automaton over every company's keywords: a single scan
+        # of the page text replaces per-company keyword searches
+        automaton = ahocorasick.Automaton()
+        for company, rules in templates.items():
+            # Fuse all of a company's patterns into one regex with named groups so
+            # extraction is a single scan of the text. Positional group names are
+            # always valid, unique identifiers (field names like "2nd Ref" are
+            # not); group_names maps them back to the template field names.
+            group_names = {}
+            branches = []
+            for index, (key, pattern) in enumerate(rules["regex_patterns"].items()):
+                if not pattern:
+                    continue
+                group = f"f{index}"
+                group_names[group] = key
+                branches.append(f"(?P<{group}>{pattern})")
+            rules["group_names"] = group_names
+            rules["combined_regex"] = re.compile("|".join(branches)) if branches else None
+            for keyword in rules["header_keywords"]:
+                # A keyword shared by several companies keeps the first-declared
+                # one, matching the old template-order precedence
+                if keyword not in automaton:
+                    automaton.add_word(keyword, company)
+        automaton.make_automaton()
+        templates["_keyword_automaton"] = automaton
+        return templates
+    except (KeyError, TypeError, ValueError, re.error) as e:
+        logging.error(f"Invalid template definition: {e}")
+        return {}
 
 # Normalize file path
 def normalize_path(file_path):
     return os.path.abspath(os.path.normpath(file_path.strip()))
 
-# Create company folder in the output directory
+# Worker-local cache of open fitz documents: each worker parses a PDF's xref
+# table once, however many of its pages it is handed
+@functools.lru_cache(maxsize=None)
+def _get_doc(pdf_path):
+    return fitz.open(pdf_path)
+
+# Render a single page to a PIL image in-process (no Poppler subprocess)
+def render_page(pdf_document, page_number, dpi=150):
+    pix = pdf_document[page_number].get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+# One persistent in-process Tesseract API per worker, set up by the pool
+# initializer (no subprocess fork or traineddata reload per page)
+_tess_api = None
+
+def _init_worker():
+    global _tess_api
+    _tess_api = tesserocr.PyTessBaseAPI(lang='eng', psm=tesserocr.PSM.AUTO)
+
+# Per-worker OCR cache keyed on the image bytes; duplicate pages skip Tesseract
+_ocr_cache = {}
+
+def ocr_image(image):
+    key = hashlib.md5(image.tobytes()).digest()
+    text = _ocr_cache.get(key)
+    if text is None:
+        _tess_api.SetImage(image)
+        text = _tess_api.GetUTF8Text()
+        _ocr_cache[key] = text
+    return text
+
+# Create company folder in the output directory (cached: one makedirs per company)
+@functools.lru_cache(maxsize=None)
 def create_company_folder(base_output_folder, company_name):
     """Creates a subfolder for each company inside the base output folder."""
     company_folder = os.path.join(base_output_folder, company_name)
-    if not os.path.exists(company_folder):
-        os.makedirs(company_folder)
-        logging.info(f"Created folder for {company_name}: {company_folder}")
+    os.makedirs(company_folder, exist_ok=True)
+    logging.info(f"Created folder for {company_name}: {company_folder}")
     return company_folder
 
-# Identify company based on header text
+# Identify company based on header text (one automaton pass over the text)
 def identify_company(text, templates):
-    for company, rules in templates.items():
-        if any(keyword in text for keyword in rules["header_keywords"]):
+    automaton = templates.get("_keyword_automaton")
+    if automaton is not None:
+        for _, company in automaton.iter(text):
             return company
     return None
 
-# Extract data using regex based on company rules
+# Extract data using regex based on company rules (single pass over the text)
 def extract_data(text, templates, company):
     extracted_info = {}
     if company in templates:
-        for key, pattern in templates[company]["regex_patterns"].items():
-            match = re.search(pattern, text)
-            extracted_info[key] = match.group() if match else None
+        rules = templates[company]
+        extracted_info = dict.fromkeys(rules["regex_patterns"])
+        if rules["combined_regex"] is not None:
+            for match in rules["combined_regex"].finditer(text):
+                key = rules["group_names"][match.lastgroup]
+                if extracted_info[key] is None:
+                    extracted_info[key] = match.group()
     return extracted_info
 
 # Process each page using OCR
 def process_page(args, templates):
     page_number, pdf_path, output_folder = args
     try:
-        pdf_document = fitz.open(pdf_path)  # Open the PDF for page count
-        images = convert_from_path(pdf_path, dpi=150)  # Batch conversion at lower DPI
-        
-        if page_number >= len(images):
-            return f"Page {page_number + 1} out of range for {pdf_path}."
+        pdf_document = _get_doc(pdf_path)
 
-        image = images[page_number]
+        if page_number >= len(pdf_document):
+            return f"Page {page_number + 1} out of range for {pdf_path}."
 
-        # Resize image for faster processing
-        image = image.resize((image.width // 2, image.height // 2))
+        # Use the embedded text layer when present; OCR only scanned pages
+        text = pdf_document[page_number].get_text("text")
+        image = None
+        if len(text.strip()) <= 50:
+            # Render at OCR resolution; downsampling costs Tesseract accuracy
+            image = render_page(pdf_document, page_number, dpi=200)
 
-        # Run OCR
-        ocr_text = pytesseract.image_to_string(image, lang='eng', config="--psm 3")
+            # Run OCR
+            text = ocr_image(image)
 
         # Identify company and extract relevant data
-        company = identify_company(ocr_text, templates)
-        extracted_data = extract_data(ocr_text, templates, company)
+        company = identify_company(text, templates)
+        extracted_data = extract_data(text, templates, company)
 
         # Extract order number for file naming
         order_number = extracted_data.get("Order Number") if extracted_data else None
@@ -96,42 +171,68 @@ def process_page(args, templates):
         if company:
             # Create folder for the company
             company_folder = create_company_folder(output_folder, company)
-            
+
+            # Pages resolved from the text layer are only rendered once a save is
+            # needed, directly at the output resolution (no render-then-downsample)
+            if image is None:
+                image = render_page(pdf_document, page_number, dpi=75)
+            else:
+                # The OCR render is 200 DPI; downscale to the 75 DPI output
+                # resolution so scanned pages are not saved at ~7x the pixels
+                image = image.resize((image.width * 75 // 200, image.height * 75 // 200))
+
             # Save the image into the company's folder with the extracted name
             output_path = os.path.join(company_folder, file_name)
-            image.save(output_path, "PNG")
+            # Light deflate: the default level-6 PNG encode dominates save time
+            image.save(output_path, "PNG", optimize=False, compress_level=1)
             logging.info(f"Page saved as image for {company}: {output_path}")
         else:
             logging.warning(f"No match found for page {page_number + 1} in {pdf_path}")
 
-        pdf_document.close()
         return f"Page {page_number + 1} processed successfully."
 
     except Exception as e:
         logging.error(f"Error processing page {page_number + 1}: {e}")
         return f"Error processing page {page_number + 1}: {e}"
 
+# Templates (compiled patterns, keyword automaton) are built once at import,
+# not on every job; the GUI offers an explicit reload after edits
+TEMPLATES = load_templates()
+
+def reload_templates():
+    global TEMPLATES
+    TEMPLATES = load_templates()
+    logging.info("Templates reloaded.")
+
 # Process multiple files with parallel execution
 def process_files(pdf_file_paths, output_folder, progress_var):
     try:
-        templates = load_templates()
-        total_pages = sum([len(fitz.open(pdf_file)) for pdf_file in pdf_file_paths])
+        templates = TEMPLATES
+        # Count pages in a single pass instead of re-opening every PDF twice
+        page_counts = {}
+        for pdf_file in pdf_file_paths:
+            pdf_document = fitz.open(pdf_file)
+            page_counts[pdf_file] = len(pdf_document)
+            pdf_document.close()
+        total_pages = sum(page_counts.values())
         completed_pages = 0
-
-        with ThreadPoolExecutor() as executor:
-            future_results = []
-            for pdf_file_path in pdf_file_paths:
-                pdf_document = fitz.open(pdf_file_path)
-                total_pages_pdf = len(pdf_document)
-                pdf_document.close()
-
-                tasks = [(page_number, pdf_file_path, output_folder) for page_number in range(total_pages_pdf)]
-                future_results.extend(executor.map(lambda args: process_page(args, templates), tasks))
-
-            for result in future_results:
+        progress_step = max(1, total_pages // 100)  # Cap GUI updates at ~100 per job
+
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as executor:
+            # Submit every page up front and consume results as they finish so
+            # progress tracks the work instead of jumping once a whole map drains
+            futures = [
+                executor.submit(process_page, (page_number, pdf_file_path, output_folder), templates)
+                for pdf_file_path in pdf_file_paths
+                for page_number in range(page_counts[pdf_file_path])
+            ]
+
+            for future in as_completed(futures):
+                future.result()
                 completed_pages += 1
-                progress_var.set((completed_pages / total_pages) * 100)  # Update progress
-                root.update_idletasks()
+                # Marshal progress updates to the Tk main loop; Tk is not thread-safe
+                if completed_pages % progress_step == 0 or completed_pages == total_pages:
+                    root.after(0, progress_var.set, (completed_pages / total_pages) * 100)
 
     except Exception as e:
         logging.error(f"An error occurred during processing: {e}")
@@ -173,22 +274,26 @@ def create_output_folder(folder_name):
 def exit_program():
     root.destroy()
 
-# GUI Setup
-root = Tk()
-root.title("PDF Processor with Template Matching")
-root.geometry("400x250")
+# GUI Setup (guarded so worker processes importing this module stay headless)
+if __name__ == "__main__":
+    root = Tk()
+    root.title("PDF Processor with Template Matching")
+    root.geometry("400x300")
+
+    title_label = Label(root, text="PDF Processor", font=("Helvetica", 16))
+    title_label.pack(pady=10)
 
-title_label = Label(root, text="PDF Processor", font=("Helvetica", 16))
-title_label.pack(pady=10)
+    convert_button = Button(root, text="Convert PDF", command=start_convert_pdf, width=20)
+    convert_button.pack(pady=10)
 
-convert_button = Button(root, text="Convert PDF", command=start_convert_pdf, width=20)
-convert_button.pack(pady=10)
+    reload_button = Button(root, text="Reload Templates", command=reload_templates, width=20)
+    reload_button.pack(pady=10)
 
-exit_button = Button(root, text="Exit", command=exit_program, width=20)
-exit_button.pack(pady=10)
+    exit_button = Button(root, text="Exit", command=exit_program, width=20)
+    exit_button.pack(pady=10)
 
-progress_var = IntVar()
-progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100)
-progress_bar.pack(pady=20, padx=20, fill='x')
+    progress_var = IntVar()
+    progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100)
+    progress_bar.pack(pady=20, padx=20, fill='x')
 
-root.mainloop()
\ No newline at end of file
+    root.mainloop()
\ No newline at end of file
@@ -1,16 +1,20 @@
 import os
+import io
 import fitz  # PyMuPDF
 import json
 import re
-from pdf2image import convert_from_path
+import ahocorasick
+import numpy as np
+from numba import njit
 from PIL import Image
-import pytesseract
 import logging
 from tkinter import Tk, Button, Label, IntVar
 from tkinter.filedialog import askopenfilenames, askdirectory
 from tkinter import ttk
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import queue
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from fpdf import FPDF  # For creating PDFs
 
 # Configure logging
@@ -20,70 +24,122 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+TEMPLATE_JSON_PATH = "C:\\Users\\Brian Mahan\\OneDrive - waynecompany.com\\Desktop\\Python scripts\\Sorting program\\Template.json"
 
-# Load template JSON
-def load_templates(json_path="C:\\Users\\Brian Mahan\\OneDrive - waynecompany.com\\Desktop\\Python scripts\\Sorting program\\Template.json"):
+# Load template JSON and pre-compile each company's patterns once
+def load_templates(json_path=TEMPLATE_JSON_PATH):
     try:
         with open(json_path, "r") as file:
-            return json.load(file)
+            templates = json.load(file)
     except FileNotFoundError:
         logging.error("Template JSON file not found.")
         return {}
+    except json.JSONDecodeError as e:
+        logging.error(f"Template JSON is malformed: {e}")
+        return {}
+
+    # Bad template definitions are logged rather than crashing the app, since
+    # this also runs at import and from the Reload Templates button
+    try:
+        # One Aho-Corasick automaton over every company's keywords: a single scan
+        # of the page text replaces per-company keyword searches
+        automaton = ahocorasick.Automaton()
+        for company, rules in templates.items():
+            rules["regex_patterns"] = {
+                key: re.compile(pattern) for key, pattern in rules["regex_patterns"].items()
+            }
+            for keyword in rules["header_keywords"]:
+                # A keyword shared by several companies keeps the first-declared
+                # one, matching the old template-order precedence
+                if keyword not in automaton:
+                    automaton.add_word(keyword, company)
+            if "layout_features" in rules:
+                rules["layout_keys"] = grid_keys(np.asarray(
+                    [feature["bounding_box"] for feature in rules["layout_features"]],
+                    dtype=np.float32
+                ).reshape(-1, 4))
+        automaton.make_automaton()
+        templates["_keyword_automaton"] = automaton
+        return templates
+    except (KeyError, TypeError, ValueError, re.error) as e:
+        logging.error(f"Invalid template definition: {e}")
+        return {}
 
 # Normalize file path
 def normalize_path(file_path):
     return os.path.abspath(os.path.normpath(file_path.strip()))
 
-# Create company folder in the output directory
+# Worker-local cache of open fitz documents: each worker parses a PDF's xref
+# table once, however many of its pages it is handed
+@functools.lru_cache(maxsize=None)
+def _get_doc(pdf_path):
+    return fitz.open(pdf_path)
+
+# Render a single page to a PIL image in-process (no Poppler subprocess)
+def render_page(pdf_document, page_number, dpi=150):
+    pix = pdf_document[page_number].get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+# Create company folder in the output directory (cached: one makedirs per company)
+@functools.lru_cache(maxsize=None)
 def create_company_folder(base_output_folder, company_name):
     """Creates a subfolder for each company inside the base output folder."""
     company_folder = os.path.join(base_output_folder, company_name)
-    if not os.path.exists(company_folder):
-        os.makedirs(company_folder)
-        logging.info(f"Created folder for {company_name}: {company_folder}")
+    os.makedirs(company_folder, exist_ok=True)
+    logging.info(f"Created folder for {company_name}: {company_folder}")
     return company_folder
 
-# Extract layout features from a page
+# Extract layout features (block bounding boxes) as a packed float32 array
 def extract_layout_features(page):
     blocks = page.get_text("blocks")
-    layout_features = []
-    for block in blocks:
-        x0, y0, x1, y1 = block[:4]  # Bounding box
-        text = block[4]  # Text content
-        layout_features.append({
-            "text": text.strip(),
-            "bounding_box": (x0, y0, x1, y1)
-        })
-    return layout_features
-
-# Compare layout features between two pages
-def compare_layouts(features1, features2):
-    similarity = 0
-    for feature1, feature2 in zip(features1, features2):
-        box1 = feature1["bounding_box"]
-        box2 = feature2["bounding_box"]
-        if abs(box1[0] - box2[0]) < 10 and abs(box1[1] - box2[1]) < 10:
-            similarity += 1
-    return similarity / max(len(features1), len(features2))
+    return np.asarray([block[:4] for block in blocks], dtype=np.float32).reshape(-1, 4)
+
+# Bin each box origin into a 20-px grid and return sorted unique cell keys
+GRID_SIZE = 20
+
+def grid_keys(boxes):
+    keys = (boxes[:, 0] // GRID_SIZE).astype(np.int64) * 65536 + (boxes[:, 1] // GRID_SIZE).astype(np.int64)
+    return np.unique(keys)
+
+# Similarity = shared occupied grid cells, independent of block order
+@njit(cache=True, nogil=True)
+def compare_layouts(keys1, keys2):
+    i = 0
+    j = 0
+    hits = 0
+    while i < keys1.shape[0] and j < keys2.shape[0]:
+        if keys1[i] == keys2[j]:
+            hits += 1
+            i += 1
+            j += 1
+        elif keys1[i] < keys2[j]:
+            i += 1
+        else:
+            j += 1
+    return hits / max(keys1.shape[0], keys2.shape[0])
 
 # Identify page based on text and layout features
 def identify_page(text, layout_features, templates):
+    # One automaton pass over the text replaces per-company keyword scans
+    automaton = templates.get("_keyword_automaton")
+    if automaton is not None:
+        for _, company in automaton.iter(text):
+            return company
+
+    # Fall back to layout similarity for pages without a keyword hit
+    page_keys = grid_keys(layout_features)
     for company, rules in templates.items():
-        text_match = any(keyword in text for keyword in rules["header_keywords"])
-        layout_similarity = 0
-        if "layout_features" in rules:
-            template_features = rules["layout_features"]
-            layout_similarity = compare_layouts(layout_features, template_features)
-        if text_match or layout_similarity > 0.8:
+        if company.startswith("_"):
+            continue
+        if "layout_keys" in rules and compare_layouts(page_keys, rules["layout_keys"]) > 0.8:
             return company
     return None
 
-# Process each page
-def process_page(args, templates, company_images):
+# Process each page and return its classification so worker processes stay stateless
+def process_page(args, templates):
     page_number, pdf_path, output_folder = args
     try:
-        pdf_document = fitz.open(pdf_path)
+        pdf_document = _get_doc(pdf_path)
         page = pdf_document[page_number]
 
         # Extract text and layout features
@@ -93,65 +149,123 @@ def process_page(args, templates, company_images):
         # Identify company
         company = identify_page(text, layout_features, templates)
 
-        # Extract page image for PDF creation
-        images = convert_from_path(pdf_path, dpi=150)
-        image = images[page_number]
-        image = image.resize((image.width // 2, image.height // 2))  # Resize for faster processing
-
         if company:
-            if company not in company_images:
-                company_images[company] = []
-            company_images[company].append(image)
+            # Render and compress only classified pages; the parent receives a
+            # small JPEG instead of a full-resolution PIL image. Rendering at the
+            # output resolution directly replaces the old render-then-resize pass.
+            image = render_page(pdf_document, page_number, dpi=75)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=85, optimize=False)
+            jpeg_page = buffer.getvalue()
             logging.info(f"Page {page_number + 1} classified under {company}.")
         else:
+            jpeg_page = None
             logging.warning(f"Page {page_number + 1} not matched to any company.")
 
-        pdf_document.close()
+        return company, jpeg_page
 
     except Exception as e:
         logging.error(f"Error processing page {page_number + 1}: {e}")
+        return None, None
 
-# Create PDFs for each company
-def create_company_pdfs(company_images, output_folder):
-    for company, images in company_images.items():
-        company_folder = create_company_folder(output_folder, company)
-        output_pdf_path = os.path.join(company_folder, f"{company}.pdf")
-
+# Append one JPEG page to a company's in-progress PDF, creating the writer lazily
+def add_company_page(company_pdfs, company, jpeg_page):
+    pdf = company_pdfs.get(company)
+    if pdf is None:
         pdf = FPDF()
         pdf.set_auto_page_break(0)
-        
-        for image in images:
-            temp_path = os.path.join(company_folder, "temp_image.jpg")
-            image.save(temp_path, "JPEG")  # Save temporary JPEG for FPDF
-            pdf.add_page()
-            pdf.image(temp_path, x=0, y=0, w=210, h=297)  # A4 dimensions in mm
-            os.remove(temp_path)  # Clean up temp file after adding to PDF
+        company_pdfs[company] = pdf
+    pdf.add_page()
+    pdf.image(io.BytesIO(jpeg_page), x=0, y=0, w=210, h=297)  # A4 dimensions in mm
 
+# Write out the accumulated per-company PDFs
+def create_company_pdfs(company_pdfs, output_folder):
+    for company, pdf in company_pdfs.items():
+        company_folder = create_company_folder(output_folder, company)
+        output_pdf_path = os.path.join(company_folder, f"{company}.pdf")
         pdf.output(output_pdf_path)
         logging.info(f"Created PDF for {company}: {output_pdf_path}")
 
+# Templates (compiled patterns, keyword automaton, layout keys) are built once
+# at import, not on every job; the GUI offers an explicit reload after edits
+TEMPLATES = load_templates()
+
+def reload_templates():
+    global TEMPLATES
+    TEMPLATES = load_templates()
+    logging.info("Templates reloaded.")
+
 # Process multiple files
 def process_files(pdf_file_paths, output_folder, progress_var):
     try:
-        templates = load_templates()
-        company_images = {}
-
-        total_pages = sum([len(fitz.open(pdf_file)) for pdf_file in pdf_file_paths])
+        templates = TEMPLATES
+        company_pdfs = {}
+
+        # Count pages in a single pass instead of re-opening every PDF twice
+        page_counts = {}
+        for pdf_file in pdf_file_paths:
+            pdf_document = fitz.open(pdf_file)
+            page_counts[pdf_file] = len(pdf_document)
+            pdf_document.close()
+        total_pages = sum(page_counts.values())
         completed_pages = 0
-
-        with ThreadPoolExecutor() as executor:
-            for pdf_file_path in pdf_file_paths:
-                pdf_document = fitz.open(pdf_file_path)
-                total_pages_pdf = len(pdf_document)
-                pdf_document.close()
-
-                tasks = [(page_number, pdf_file_path, output_folder) for page_number in range(total_pages_pdf)]
-                for result in executor.map(lambda args: process_page(args, templates, company_images), tasks):
+        progress_step = max(1, total_pages // 100)  # Cap GUI updates at ~100 per job
+
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # Submit every page up front and consume results as they finish so
+            # progress tracks the work instead of jumping once a whole map drains
+            futures = [
+                executor.submit(process_page, (page_number, pdf_file_path, output_folder), templates)
+                for pdf_file_path in pdf_file_paths
+                for page_number in range(page_counts[pdf_file_path])
+            ]
+
+            # Writer stage: embedding JPEGs into the company PDFs runs on its own
+            # thread fed by a bounded queue, so PDF building overlaps with the
+            # workers producing the next pages instead of serializing behind them
+            page_queue = queue.Queue(maxsize=4)
+            writer_errors = []
+
+            def write_pages():
+                while True:
+                    item = page_queue.get()
+                    if item is None:
+                        break
+                    try:
+                        add_company_page(company_pdfs, *item)
+                    except Exception as e:
+                        # Keep draining so the producer never blocks on a full
+                        # queue; the error is re-raised after join
+                        writer_errors.append(e)
+
+            writer = threading.Thread(target=write_pages)
+            writer.start()
+
+            # Pages must land in their company PDFs in submission order, so
+            # out-of-order completions wait in a small reorder buffer
+            future_index = {future: index for index, future in enumerate(futures)}
+            pending = {}
+            next_index = 0
+            try:
+                for future in as_completed(futures):
+                    pending[future_index[future]] = future.result()
+                    while next_index in pending:
+                        company, jpeg_page = pending.pop(next_index)
+                        next_index += 1
+                        if company:
+                            page_queue.put((company, jpeg_page))
                     completed_pages += 1
-                    progress_var.set((completed_pages / total_pages) * 100)
-                    root.update_idletasks()
-
-        create_company_pdfs(company_images, output_folder)
+                    # Marshal progress updates to the Tk main loop; Tk is not thread-safe
+                    if completed_pages % progress_step == 0 or completed_pages == total_pages:
+                        root.after(0, progress_var.set, (completed_pages / total_pages) * 100)
+            finally:
+                # Always unblock the writer, even if a worker future raised
+                page_queue.put(None)
+                writer.join()
+            if writer_errors:
+                raise writer_errors[0]
+
+        create_company_pdfs(company_pdfs, output_folder)
 
     except Exception as e:
         logging.error(f"An error occurred during processing: {e}")
@@ -192,22 +306,26 @@ def create_output_folder(folder_name):
 def exit_program():
     root.destroy()
 
-# GUI Setup
-root = Tk()
-root.title("PDF Processor with Text and Layout Analysis")
-root.geometry("400x250")
+# GUI Setup (guarded so worker processes importing this module stay headless)
+if __name__ == "__main__":
+    root = Tk()
+    root.title("PDF Processor with Text and Layout Analysis")
+    root.geometry("400x300")
+
+    title_label = Label(root, text="PDF Processor", font=("Helvetica", 16))
+    title_label.pack(pady=10)
 
-title_label = Label(root, text="PDF Processor", font=("Helvetica", 16))
-title_label.pack(pady=10)
+    convert_button = Button(root, text="Convert PDF", command=start_convert_pdf, width=20)
+    convert_button.pack(pady=10)
 
-convert_button = Button(root, text="Convert PDF", command=start_convert_pdf, width=20)
-convert_button.pack(pady=10)
+    reload_button = Button(root, text="Reload Templates", command=reload_templates, width=20)
+    reload_button.pack(pady=10)
 
-exit_button = Button(root, text="Exit", command=exit_program, width=20)
-exit_button.pack(pady=10)
+    exit_button = Button(root, text="Exit", command=exit_program, width=20)
+    exit_button.pack(pady=10)
 
-progress_var = IntVar()
-progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100)
-progress_bar.pack(pady=20, padx=20, fill='x')
+    progress_var = IntVar()
+    progress_bar = ttk.Progressbar(root, variable=progress_var, maximum=100)
+    progress_bar.pack(pady=20, padx=20, fill='x')
 
-root.mainloop()
\ No newline at end of file
+    root.mainloop()
\ No newline at end of file